@@ -1,10 +1,71 @@
 import requests
 import os
 import re
+import random
+import shutil
+import asyncio
+import aiohttp
+import aiofiles
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, urlparse
+from urllib3.util.retry import Retry
 import subprocess
 import tempfile
 
+try:
+    import m3u8 as m3u8_parser
+except ImportError:
+    m3u8_parser = None
+
+# Maximum number of TS segments downloaded concurrently
+MAX_CONCURRENT_DOWNLOADS = 16
+
+# Number of worker coroutines consuming the segment queue
+MAX_WORKERS = 12
+
+# Size of each byte-range chunk when splitting a single segment
+RANGE_CHUNK_SIZE = 2 * 1024 * 1024
+
+# Buffer size for streaming response bodies to disk
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Flush + fsync the resume state log every this many completed segments
+STATE_FLUSH_INTERVAL = 16
+
+# Max completed segments held in memory ahead of the mux point when
+# piping straight into ffmpeg
+PIPE_BUFFER_SEGMENTS = 32
+
+# Retry policy for transient segment-download failures
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+RETRY_JITTER = 0.5
+
+# Classifies playlist lines: group 1 matches a discontinuity tag,
+# a group-less match is a TS segment URI
+_PLAYLIST_LINE_RE = re.compile(r'(^#EXT-X-DISCONTINUITY)|\.ts(?:\?|$)')
+
+def make_http_session():
+    """
+    Create a requests.Session with keep-alive pooling and retries.
+
+    Reusing one session amortizes the TCP+TLS handshake across requests
+    instead of paying it on every call.
+
+    Returns:
+        requests.Session: Configured session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 def download_m3u8_video_to_mp4(m3u8_url, output_filename, headers=None):
     """
     Download m3u8 video while filtering out advertisement segments and convert to MP4.
@@ -24,37 +85,33 @@ def download_m3u8_video_to_mp4(m3u8_url, output_filename, headers=None):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
 
-    # Download and parse m3u8 content
-    response = requests.get(m3u8_url, headers=headers)
-    response.raise_for_status()
-
-    m3u8_content = response.text
+    asyncio.run(_pipeline_to_mp4(m3u8_url, output_filename, headers))
 
-    # Filter out advertisement segments
-    filtered_content = filter_ad_segments(m3u8_content)
+async def _pipeline_to_mp4(m3u8_url, output_filename, headers):
+    """
+    Run the whole download-and-remux pipeline on one event loop.
 
-    # Save filtered m3u8 content
-    temp_m3u8_path = "temp_filtered.m3u8"
-    with open(temp_m3u8_path, 'w', encoding='utf-8') as f:
-        f.write(filtered_content)
+    The playlist fetch, the segment downloads, and the ffmpeg stdin
+    feed all share a single aiohttp session and overlap, so total
+    wall-clock approaches max(download time, mux time) instead of
+    their sum.
+    """
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS)
 
-    # Download TS segments
-    base_url = m3u8_url.rsplit('/', 1)[0] + '/'
-    ts_files = download_ts_segments(filtered_content, base_url, headers)
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        # Download and parse m3u8 content
+        async with session.get(m3u8_url) as response:
+            response.raise_for_status()
+            m3u8_content = await response.text()
 
-    # Create temporary TS file for conversion
-    temp_ts_file = "temp_concatenated.ts"
-    concatenate_videos(ts_files, temp_ts_file)
+        # Filter out advertisement segments; the filtered playlist is
+        # consumed in-process, so nothing is written to disk
+        _, segment_uris = filter_ad_segments(m3u8_content)
 
-    # Convert TS to MP4 using ffmpeg
-    convert_ts_to_mp4(temp_ts_file, output_filename)
+        base_url = m3u8_url.rsplit('/', 1)[0] + '/'
 
-    # Clean up temporary files
-    cleanup_temp_files(temp_m3u8_path, ts_files)
-    try:
-        os.remove(temp_ts_file)
-    except Exception as e:
-        print(f"Error removing temporary TS file: {e}")
+        # Pipe the segments straight into ffmpeg as they arrive
+        await stream_segments_to_mp4(session, segment_uris, base_url, output_filename)
 
 def convert_ts_to_mp4(input_ts_file, output_mp4_file):
     """
@@ -67,21 +124,23 @@ def convert_ts_to_mp4(input_ts_file, output_mp4_file):
     try:
         # Use ffmpeg to convert TS to MP4
         cmd = [
-            'ffmpeg',
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
             '-i', input_ts_file,
             '-c', 'copy',
             '-bsf:a', 'aac_adtstoasc',
             output_mp4_file
         ]
 
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        # Discard stdout and keep only the error-level stderr, so a
+        # multi-hour conversion doesn't accumulate log output in memory
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode == 0:
             print(f"Successfully converted to {output_mp4_file}")
         else:
-            print(f"FFmpeg error: {result.stderr}")
+            print(f"FFmpeg error: {result.stderr.decode(errors='replace')}")
             # Fallback: try with re-encoding
             cmd = [
-                'ffmpeg',
+                'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
                 '-i', input_ts_file,
                 '-c:v', 'libx264',
                 '-c:a', 'aac',
@@ -95,8 +154,66 @@ def convert_ts_to_mp4(input_ts_file, output_mp4_file):
     except subprocess.CalledProcessError as e:
         print(f"Error converting TS to MP4: {e}")
 
-# The rest of the functions remain the same as in your existing code
-# filter_ad_segments, download_ts_segments, concatenate_videos, cleanup_temp_files
+def convert_ts_segments_to_mp4(ts_files, output_mp4_file):
+    """
+    Remux TS segments straight into an MP4 with ffmpeg's concat demuxer.
+
+    Skips the intermediate concatenated TS file entirely, so each video
+    byte is written to disk once instead of twice.
+
+    Args:
+        ts_files (list): List of TS filenames in playback order
+        output_mp4_file (str): Output MP4 filename
+    """
+    # Write the segment list in concat-demuxer format
+    list_file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    try:
+        with list_file:
+            for ts_file in ts_files:
+                path = os.path.abspath(ts_file).replace("'", "'\\''")
+                list_file.write(f"file '{path}'\n")
+
+        try:
+            cmd = [
+                'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', list_file.name,
+                '-c', 'copy',
+                '-bsf:a', 'aac_adtstoasc',
+                output_mp4_file
+            ]
+
+            # Discard stdout and keep only the error-level stderr, so a
+            # long remux doesn't accumulate log output in memory
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if result.returncode == 0:
+                print(f"Successfully converted to {output_mp4_file}")
+            else:
+                print(f"FFmpeg error: {result.stderr.decode(errors='replace')}")
+                # Fallback: try with re-encoding
+                cmd = [
+                    'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+                    '-f', 'concat',
+                    '-safe', '0',
+                    '-i', list_file.name,
+                    '-c:v', 'libx264',
+                    '-c:a', 'aac',
+                    output_mp4_file
+                ]
+                subprocess.run(cmd, check=True)
+                print(f"Successfully converted to {output_mp4_file} (re-encoded)")
+        except FileNotFoundError:
+            print("FFmpeg not found. Please install FFmpeg to convert TS to MP4.")
+            print("You can install it with: conda install ffmpeg or download from https://ffmpeg.org/")
+        except subprocess.CalledProcessError as e:
+            print(f"Error converting TS to MP4: {e}")
+    finally:
+        try:
+            os.remove(list_file.name)
+        except OSError:
+            pass
+
 def filter_ad_segments(m3u8_content):
     """
     Filter out advertisement segments based on EXT-X-DISCONTINUITY tags.
@@ -106,163 +223,510 @@ def filter_ad_segments(m3u8_content):
     - Remove segments between 2nd and 3rd #EXT-X-DISCONTINUITY tags
     - Continue pattern: remove segments between 4th-5th, 6th-7th, etc.
 
+    Uses the m3u8 library when it is installed, which understands tags
+    the line-based scan does not (EXT-X-MAP, EXT-X-KEY,
+    EXT-X-BYTERANGE) and keeps them consistent in the filtered output.
+    Otherwise a single pass classifies each line with one compiled
+    regex, applies the discontinuity parity rule, and collects the
+    surviving segment URIs at the same time.
+
     Args:
         m3u8_content (str): Raw m3u8 file content
 
     Returns:
-        str: Filtered m3u8 content without advertisement segments
+        tuple: (filtered_lines, segment_uris) — the kept playlist lines,
+               and the TS segment URIs among them in playback order
     """
-    lines = m3u8_content.strip().split('\n')
+    if m3u8_parser is not None:
+        return _filter_ad_segments_parsed(m3u8_content)
+
     filtered_lines = []
+    segment_uris = []
 
     discontinuity_count = 0
     skip_segment = False
 
-    for line in lines:
-        if line.startswith('#EXT-X-DISCONTINUITY'):
+    for line in m3u8_content.strip().split('\n'):
+        match = _PLAYLIST_LINE_RE.search(line)
+        if match and match.group(1):
             discontinuity_count += 1
 
-            # First discontinuity: keep content after it
-            if discontinuity_count == 1:
-                filtered_lines.append(line)
-                skip_segment = False
-            # Even numbered discontinuities (2, 4, 6...): start skipping
-            elif discontinuity_count % 2 == 0:
-                skip_segment = True
-            # Odd numbered discontinuities (3, 5, 7...): stop skipping
-            else:
-                skip_segment = False
+            # Segments after even-numbered discontinuities (2, 4, 6...)
+            # are ads; everything else is kept
+            skip_segment = discontinuity_count >= 2 and discontinuity_count % 2 == 0
+            if not skip_segment:
                 filtered_lines.append(line)
         elif not skip_segment:
             filtered_lines.append(line)
+            if match:
+                segment_uris.append(line)
 
-    return '\n'.join(filtered_lines)
+    return filtered_lines, segment_uris
 
-def filter_ad_segments(m3u8_content):
+def _filter_ad_segments_parsed(m3u8_content):
     """
-    Filter out advertisement segments based on EXT-X-DISCONTINUITY tags.
+    Apply the discontinuity parity rule over a parsed m3u8 playlist.
 
-    Args:
-        m3u8_content (str): Raw m3u8 file content
-
-    Returns:
-        str: Filtered m3u8 content without advertisement segments
+    The filtered playlist is regenerated by the library, so structural
+    tags attached to the surviving segments are preserved correctly.
     """
-    lines = m3u8_content.strip().split('\n')
-    filtered_lines = []
+    playlist = m3u8_parser.loads(m3u8_content)
 
+    kept = []
     discontinuity_count = 0
     skip_segment = False
 
-    for line in lines:
-        if line.startswith('#EXT-X-DISCONTINUITY'):
+    for segment in playlist.segments:
+        if segment.discontinuity:
             discontinuity_count += 1
+            skip_segment = discontinuity_count >= 2 and discontinuity_count % 2 == 0
+        if not skip_segment:
+            kept.append(segment)
 
-            # First discontinuity: keep content after it
-            if discontinuity_count == 1:
-                filtered_lines.append(line)
-                skip_segment = False
-            # Even numbered discontinuities (2, 4, 6...): start skipping
-            elif discontinuity_count % 2 == 0:
-                skip_segment = True
-            # Odd numbered discontinuities (3, 5, 7...): stop skipping
-            else:
-                skip_segment = False
-                filtered_lines.append(line)
-        elif not skip_segment:
-            filtered_lines.append(line)
+    playlist.segments = m3u8_parser.SegmentList(kept)
+    filtered_lines = playlist.dumps().strip().split('\n')
+    segment_uris = [segment.uri for segment in kept]
 
-    return '\n'.join(filtered_lines)
+    return filtered_lines, segment_uris
 
-def download_ts_segments(m3u8_content, base_url, headers):
+def collect_ts_segments(segment_uris, base_url, work_dir):
     """
-    Download TS segments from filtered m3u8 content.
+    Resolve (url, path) pairs for the given TS segment URIs.
 
     Args:
-        m3u8_content (str): Filtered m3u8 content
+        segment_uris (list): Segment URIs from filter_ad_segments
         base_url (str): Base URL for resolving relative paths
-        headers (dict): Headers for HTTP requests
+        work_dir (str): Directory the segment files are written into
 
     Returns:
-        list: List of downloaded TS filenames
+        list: List of (ts_url, filename) tuples
     """
-    lines = m3u8_content.strip().split('\n')
-    ts_files = []
+    ts_list = []
 
-    for line in lines:
-        if line.endswith('.ts') or '.ts?' in line:
-            ts_url = urljoin(base_url, line)
-            filename = os.path.basename(urlparse(ts_url).path)
+    for line in segment_uris:
+        ts_url = urljoin(base_url, line)
+        filename = os.path.basename(urlparse(ts_url).path)
 
-            if not filename:
-                filename = f"segment_{len(ts_files)}.ts"
+        if not filename:
+            filename = f"segment_{len(ts_list)}.ts"
 
-            print(f"Downloading {filename}...")
-            response = requests.get(ts_url, headers=headers)
-            response.raise_for_status()
+        ts_list.append((ts_url, os.path.join(work_dir, filename)))
 
-            with open(filename, 'wb') as f:
-                f.write(response.content)
+    return ts_list
 
-            ts_files.append(filename)
+async def _probe_range_support(session, ts_url):
+    """
+    Probe the server for segment size and byte-range support.
 
-    return ts_files
+    Returns:
+        tuple: (content_length, accepts_ranges); content_length is 0 when
+               the server does not report it
+    """
+    try:
+        async with session.head(ts_url) as response:
+            if response.status >= 400:
+                return 0, False
+            size = int(response.headers.get('Content-Length', 0))
+            accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            return size, accepts_ranges
+    except aiohttp.ClientError:
+        return 0, False
+
+async def _fetch_segment_ranged(session, ts_url, filename, size):
+    """
+    Download one segment as concurrent byte-range GETs.
 
-def concatenate_videos(ts_files, output_filename):
+    The output file is preallocated and each chunk lands at its own
+    offset via os.pwrite, so the writers need no locking.
+
+    Returns:
+        bool: True on success, False if the server ignored the Range
+              header (caller should fall back to a sequential GET)
     """
-    Concatenate TS files into a single video file.
+    ranges = [
+        (lo, min(lo + RANGE_CHUNK_SIZE, size) - 1)
+        for lo in range(0, size, RANGE_CHUNK_SIZE)
+    ]
+
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+
+        async def fetch_range(lo, hi):
+            range_headers = {'Range': f'bytes={lo}-{hi}'}
+            async with session.get(ts_url, headers=range_headers) as response:
+                if response.status != 206:
+                    # Server ignored the Range header
+                    return False
+                loop = asyncio.get_running_loop()
+                offset = lo
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    # pwrite in the default executor so the syscall
+                    # doesn't stall the event loop
+                    await loop.run_in_executor(None, os.pwrite, fd, chunk, offset)
+                    offset += len(chunk)
+                return True
+
+        results = await asyncio.gather(*[fetch_range(lo, hi) for lo, hi in ranges])
+        if not all(results):
+            return False
+        return True
+    finally:
+        os.close(fd)
+
+async def _resume_partial_segment(session, ts_url, filename, existing):
+    """
+    Continue an interrupted segment download from its last written byte.
+
+    Returns:
+        bool: True if the file is now complete, False if the partial
+              file is unusable and a fresh download is needed
+    """
+    range_headers = {'Range': f'bytes={existing}-'}
+    async with session.get(ts_url, headers=range_headers) as response:
+        if response.status == 206:
+            # Server honored the range; append the remaining bytes
+            print(f"Resuming {filename} from byte {existing}...")
+            mode = 'ab'
+        elif response.status == 200:
+            # Server ignored the range; rewrite the file from scratch
+            mode = 'wb'
+        elif response.status == 416:
+            # Offset at or past EOF, e.g. a preallocated file left by an
+            # interrupted byte-range download — redownload from scratch
+            return False
+        else:
+            response.raise_for_status()
+            return False
+
+        async with aiofiles.open(filename, mode) as f:
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                await f.write(chunk)
+        return True
+
+async def _fetch_segment(session, ts_url, filename):
+    """Download a single TS segment to disk over the shared session."""
+    print(f"Downloading {filename}...")
+
+    # A partial file from an earlier run is continued from where it
+    # stopped; the on-disk size is the authoritative byte offset
+    existing = os.path.getsize(filename) if os.path.exists(filename) else 0
+    if existing > 0:
+        if await _resume_partial_segment(session, ts_url, filename, existing):
+            return
+        os.remove(filename)
+
+    # Segments large enough to span several chunks are split into
+    # concurrent byte-range GETs when the server supports them
+    size, accepts_ranges = await _probe_range_support(session, ts_url)
+    if accepts_ranges and size > RANGE_CHUNK_SIZE:
+        if await _fetch_segment_ranged(session, ts_url, filename, size):
+            return
+
+    async with session.get(ts_url) as response:
+        response.raise_for_status()
+        async with aiofiles.open(filename, 'wb') as f:
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                await f.write(chunk)
+
+async def _with_retries(label, fetch):
+    """
+    Run an async fetch, retrying transient failures with exponential
+    backoff plus random jitter so retries don't hammer the server in
+    lockstep.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await fetch()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            delay += random.uniform(0, RETRY_JITTER)
+            print(f"Retrying {label} in {delay:.1f}s ({e})")
+            await asyncio.sleep(delay)
+
+async def _fetch_segment_with_retry(session, ts_url, filename):
+    """Fetch one segment to disk, retrying transient failures."""
+    await _with_retries(filename, lambda: _fetch_segment(session, ts_url, filename))
+
+async def _fetch_segment_bytes(session, ts_url):
+    """Fetch one segment body into memory for the ffmpeg pipe path."""
+    chunks = []
+    async with session.get(ts_url) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+async def _segment_worker(queue, session, errors, on_complete):
+    """Consume (ts_url, filename) items from the queue until cancelled."""
+    while True:
+        ts_url, filename = await queue.get()
+        try:
+            await _fetch_segment_with_retry(session, ts_url, filename)
+            if on_complete is not None:
+                on_complete(filename)
+        except Exception as e:
+            print(f"Error downloading {filename}: {e}")
+            errors.append(e)
+        finally:
+            queue.task_done()
+
+async def _download_segments(ts_list, headers, on_complete=None):
+    """
+    Download all segments through a bounded pool of worker coroutines.
+
+    A fixed number of workers pull from an asyncio.Queue, so the number
+    of sockets and open files stays capped no matter how many segments
+    the playlist contains.
 
     Args:
-        ts_files (list): List of TS filenames
-        output_filename (str): Output filename
+        ts_list (list): List of (ts_url, filename) tuples
+        headers (dict): Headers for HTTP requests
+        on_complete (callable): Optional callback invoked with each filename
+                                after its download finishes
     """
-    print("Concatenating video segments...")
+    queue = asyncio.Queue()
+    for item in ts_list:
+        queue.put_nowait(item)
 
-    with open(output_filename, 'wb') as outfile:
-        for ts_file in ts_files:
-            with open(ts_file, 'rb') as infile:
-                outfile.write(infile.read())
+    errors = []
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS)
 
-def cleanup_temp_files(temp_m3u8_path, ts_files):
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        workers = [
+            asyncio.create_task(_segment_worker(queue, session, errors, on_complete))
+            for _ in range(MAX_WORKERS)
+        ]
+
+        await queue.join()
+
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    if errors:
+        raise errors[0]
+
+async def _stream_segments_to_ffmpeg(session, ts_urls, stdin):
+    """
+    Download segments concurrently and write them to ffmpeg's stdin in
+    playback order.
+
+    Completed segments ahead of the mux point wait in an in-memory
+    reorder buffer capped at PIPE_BUFFER_SEGMENTS; workers that get too
+    far ahead block until the contiguous prefix catches up.
+    """
+    queue = asyncio.Queue()
+    for item in enumerate(ts_urls):
+        queue.put_nowait(item)
+
+    buffered = {}
+    cursor = {'next': 0}
+    cond = asyncio.Condition()
+    errors = []
+
+    async def worker(session):
+        while True:
+            index, ts_url = await queue.get()
+            try:
+                # Keep the reorder buffer bounded
+                async with cond:
+                    await cond.wait_for(
+                        lambda: index < cursor['next'] + PIPE_BUFFER_SEGMENTS or errors
+                    )
+                if not errors:
+                    print(f"Downloading segment {index + 1}/{len(ts_urls)}...")
+                    data = await _with_retries(
+                        f"segment {index + 1}",
+                        lambda: _fetch_segment_bytes(session, ts_url)
+                    )
+                    async with cond:
+                        buffered[index] = data
+                        cond.notify_all()
+            except Exception as e:
+                print(f"Error downloading segment {index + 1}: {e}")
+                async with cond:
+                    errors.append(e)
+                    cond.notify_all()
+            finally:
+                queue.task_done()
+
+    async def mux_writer():
+        try:
+            while cursor['next'] < len(ts_urls):
+                async with cond:
+                    await cond.wait_for(lambda: cursor['next'] in buffered or errors)
+                    if errors:
+                        return
+                    data = buffered.pop(cursor['next'])
+                # drain() applies pipe backpressure without blocking
+                # the loop, so downloads continue while ffmpeg muxes
+                stdin.write(data)
+                await stdin.drain()
+                async with cond:
+                    cursor['next'] += 1
+                    cond.notify_all()
+        except Exception as e:
+            print(f"Error writing to ffmpeg: {e}")
+            async with cond:
+                errors.append(e)
+                cond.notify_all()
+
+    workers = [
+        asyncio.create_task(worker(session)) for _ in range(MAX_WORKERS)
+    ]
+    writer = asyncio.create_task(mux_writer())
+
+    await queue.join()
+    await writer
+
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+    if errors:
+        raise errors[0]
+
+async def stream_segments_to_mp4(session, segment_uris, base_url, output_mp4_file):
     """
-    Clean up temporary files.
+    Download segments and pipe them straight into ffmpeg's stdin.
+
+    Segment bytes never touch the disk: each segment is muxed into the
+    MP4 as soon as the contiguous playback prefix reaches it, while
+    later segments are still downloading.
 
     Args:
-        temp_m3u8_path (str): Path to temporary m3u8 file
-        ts_files (list): List of TS filenames to delete
+        session (aiohttp.ClientSession): Shared session for segment GETs
+        segment_uris (list): Segment URIs from filter_ad_segments
+        base_url (str): Base URL for resolving relative paths
+        output_mp4_file (str): Output MP4 filename
     """
+    ts_urls = [urljoin(base_url, line) for line in segment_uris]
+
+    cmd = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'mpegts',
+        '-i', 'pipe:0',
+        '-c', 'copy',
+        '-bsf:a', 'aac_adtstoasc',
+        output_mp4_file
+    ]
+
     try:
-        os.remove(temp_m3u8_path)
-        for ts_file in ts_files:
-            os.remove(ts_file)
-        print("Temporary files cleaned up.")
-    except Exception as e:
-        print(f"Error cleaning up temporary files: {e}")
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.PIPE)
+    except FileNotFoundError:
+        print("FFmpeg not found. Please install FFmpeg to convert TS to MP4.")
+        print("You can install it with: conda install ffmpeg or download from https://ffmpeg.org/")
+        return
+
+    try:
+        await _stream_segments_to_ffmpeg(session, ts_urls, proc.stdin)
+    finally:
+        proc.stdin.close()
+        returncode = await proc.wait()
+
+    if returncode == 0:
+        print(f"Successfully converted to {output_mp4_file}")
+    else:
+        print(f"FFmpeg exited with code {returncode}")
+
+def download_ts_segments(segment_uris, base_url, headers, work_dir):
+    """
+    Download the given TS segments.
+
+    Args:
+        segment_uris (list): Segment URIs from filter_ad_segments
+        base_url (str): Base URL for resolving relative paths
+        headers (dict): Headers for HTTP requests
+        work_dir (str): Directory the segment files are written into
+
+    Returns:
+        list: List of downloaded TS filenames
+    """
+    ts_list = collect_ts_segments(segment_uris, base_url, work_dir)
+    asyncio.run(_download_segments(ts_list, headers))
+    return [filename for _, filename in ts_list]
+
+def concatenate_videos(ts_files, output_filename):
+    """
+    Concatenate TS files into a single video file.
+
+    Uses os.sendfile where available so the bytes are copied entirely in
+    kernel space, never passing through a Python buffer. Falls back to a
+    buffered copy on platforms without sendfile.
+
+    Args:
+        ts_files (list): List of TS filenames
+        output_filename (str): Output filename
+    """
+    print("Concatenating video segments...")
+
+    total_size = sum(os.path.getsize(ts_file) for ts_file in ts_files)
+
+    if hasattr(os, 'sendfile'):
+        out_fd = os.open(output_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # Reserve the full output up-front so the filesystem can
+            # allocate one contiguous extent instead of growing the
+            # file piecemeal
+            if hasattr(os, 'posix_fallocate') and total_size > 0:
+                try:
+                    os.posix_fallocate(out_fd, 0, total_size)
+                except OSError:
+                    # Filesystem doesn't support fallocate
+                    pass
+            for ts_file in ts_files:
+                in_fd = os.open(ts_file, os.O_RDONLY)
+                try:
+                    size = os.fstat(in_fd).st_size
+                    offset = 0
+                    while offset < size:
+                        sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+                        if sent == 0:
+                            break
+                        offset += sent
+                finally:
+                    os.close(in_fd)
+        finally:
+            os.close(out_fd)
+    else:
+        with open(output_filename, 'wb') as outfile:
+            for ts_file in ts_files:
+                with open(ts_file, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile, STREAM_CHUNK_SIZE)
 
-import json
 import hashlib
 
 def get_download_state_filename(m3u8_url):
     """Generate a unique state filename based on m3u8 URL"""
     url_hash = hashlib.md5(m3u8_url.encode()).hexdigest()
-    return f"download_state_{url_hash}.json"
+    return f"download_state_{url_hash}.log"
+
+def get_segment_dirname(m3u8_url, scratch_dir=None):
+    """Generate a stable per-URL segment directory for resumable runs"""
+    url_hash = hashlib.md5(m3u8_url.encode()).hexdigest()
+    dirname = f"m3u8_segments_{url_hash}"
+    if scratch_dir:
+        dirname = os.path.join(scratch_dir, dirname)
+    return dirname
 
-def load_download_state(m3u8_url):
-    """Load download state from file"""
+def load_downloaded_segments(m3u8_url):
+    """
+    Load the set of completed segment filenames from the state log.
+
+    The log is append-only (one filename per line), so a crash can at
+    worst lose its final line; earlier entries stay intact.
+    """
     state_file = get_download_state_filename(m3u8_url)
     try:
         with open(state_file, 'r') as f:
-            return json.load(f)
+            return set(line.rstrip('\n') for line in f if line.strip())
     except FileNotFoundError:
-        return {"downloaded_segments": [], "total_segments": 0}
+        return set()
 
-def save_download_state(m3u8_url, state):
-    """Save download state to file"""
-    state_file = get_download_state_filename(m3u8_url)
-    with open(state_file, 'w') as f:
-        json.dump(state, f)
-
-def download_m3u8_video_to_mp4_with_resume(m3u8_url, output_filename, headers=None):
+def download_m3u8_video_to_mp4_with_resume(m3u8_url, output_filename, headers=None, scratch_dir=None):
     """
     Enhanced version with resume capability
     """
@@ -276,101 +740,82 @@ def download_m3u8_video_to_mp4_with_resume(m3u8_url, output_filename, headers=No
         }
 
     # Load download state
-    download_state = load_download_state(m3u8_url)
-    downloaded_segments = set(download_state.get("downloaded_segments", []))
+    downloaded_segments = load_downloaded_segments(m3u8_url)
 
     # Download and parse m3u8 content
-    response = requests.get(m3u8_url, headers=headers)
+    session = make_http_session()
+    response = session.get(m3u8_url, headers=headers)
     response.raise_for_status()
 
     m3u8_content = response.text
 
-    # Filter out advertisement segments
-    filtered_content = filter_ad_segments(m3u8_content)
+    # Filter out advertisement segments; the filtered playlist is
+    # consumed in-process, so nothing is written to disk
+    _, segment_uris = filter_ad_segments(m3u8_content)
 
-    # Save filtered m3u8 content
-    temp_m3u8_path = "temp_filtered.m3u8"
-    with open(temp_m3u8_path, 'w', encoding='utf-8') as f:
-        f.write(filtered_content)
+    # Segments must survive across interrupted runs, so they live in a
+    # stable per-URL directory rather than a TemporaryDirectory
+    work_dir = get_segment_dirname(m3u8_url, scratch_dir)
+    os.makedirs(work_dir, exist_ok=True)
 
     # Download TS segments with resume support
     base_url = m3u8_url.rsplit('/', 1)[0] + '/'
     ts_files = download_ts_segments_with_resume(
-        filtered_content, base_url, headers, downloaded_segments, m3u8_url
+        segment_uris, base_url, headers, downloaded_segments, m3u8_url, work_dir
     )
 
-    # Create temporary TS file for conversion
-    temp_ts_file = "temp_concatenated.ts"
-    concatenate_videos(ts_files, temp_ts_file)
-
-    # Convert TS to MP4 using ffmpeg
-    convert_ts_to_mp4(temp_ts_file, output_filename)
+    # Remux the segments directly to MP4 using ffmpeg's concat demuxer
+    convert_ts_segments_to_mp4(ts_files, output_filename)
 
-    # Clean up temporary files
-    cleanup_temp_files(temp_m3u8_path, ts_files)
+    # Clean up the segment directory and state file after success
     try:
-        os.remove(temp_ts_file)
-        # Remove state file after successful download
+        shutil.rmtree(work_dir)
         state_file = get_download_state_filename(m3u8_url)
         if os.path.exists(state_file):
             os.remove(state_file)
     except Exception as e:
         print(f"Error removing temporary files: {e}")
 
-def download_ts_segments_with_resume(m3u8_content, base_url, headers, downloaded_segments, m3u8_url):
+def download_ts_segments_with_resume(segment_uris, base_url, headers, downloaded_segments, m3u8_url, work_dir):
     """
     Download TS segments with resume support
     """
-    lines = m3u8_content.strip().split('\n')
-    ts_files = []
-
-    # Load current state
-    download_state = load_download_state(m3u8_url)
-    downloaded_list = download_state.get("downloaded_segments", [])
-
-    # Count total segments
-    total_segments = sum(1 for line in lines if line.endswith('.ts') or '.ts?' in line)
-    download_state["total_segments"] = total_segments
-    save_download_state(m3u8_url, download_state)
-
-    segment_index = 0
-    for line in lines:
-        if line.endswith('.ts') or '.ts?' in line:
-            segment_index += 1
-
-            ts_url = urljoin(base_url, line)
-            filename = os.path.basename(urlparse(ts_url).path)
-
-            if not filename:
-                filename = f"segment_{len(ts_files)}.ts"
-
-            # Check if segment was already downloaded
-            if filename in downloaded_segments:
-                print(f"Skipping {filename} (already downloaded)")
-                ts_files.append(filename)
-                continue
-
-            print(f"Downloading {filename} ({segment_index}/{total_segments})...")
-            try:
-                response = requests.get(ts_url, headers=headers)
-                response.raise_for_status()
-
-                with open(filename, 'wb') as f:
-                    f.write(response.content)
+    ts_list = collect_ts_segments(segment_uris, base_url, work_dir)
+
+    # Skip segments that were already downloaded; the state log stores
+    # bare filenames so entries stay valid wherever work_dir lands
+    pending = []
+    for ts_url, filename in ts_list:
+        if os.path.basename(filename) in downloaded_segments:
+            print(f"Skipping {filename} (already downloaded)")
+        else:
+            pending.append((ts_url, filename))
 
-                ts_files.append(filename)
+    # Append each completed filename to the state log; fsync only every
+    # STATE_FLUSH_INTERVAL segments so the disk-sync cost is amortized
+    state_log = open(get_download_state_filename(m3u8_url), 'a')
+    dirty = 0
 
-                # Update state
-                if filename not in downloaded_list:
-                    downloaded_list.append(filename)
-                download_state["downloaded_segments"] = downloaded_list
-                save_download_state(m3u8_url, download_state)
+    def flush_state():
+        state_log.flush()
+        os.fsync(state_log.fileno())
 
-            except Exception as e:
-                print(f"Error downloading {filename}: {e}")
-                raise
+    def record_downloaded(filename):
+        nonlocal dirty
+        state_log.write(os.path.basename(filename) + '\n')
+        dirty += 1
+        if dirty % STATE_FLUSH_INTERVAL == 0:
+            flush_state()
 
-    return ts_files
+    try:
+        asyncio.run(_download_segments(pending, headers, on_complete=record_downloaded))
+    finally:
+        # Runs on KeyboardInterrupt too, so an interrupted run keeps
+        # every segment completed so far
+        flush_state()
+        state_log.close()
+
+    return [filename for _, filename in ts_list]
 
 if __name__ == '__main__':
     m3u8_url = 'https://vip.dytt-cinema.com/20251121/41158_e3f37a80/3000k/hls/mixed.m3u8'